@@ -7,13 +7,50 @@ const { Client } = require("pg");
 const crypto = require("crypto");
 const path = require("path");
 const fs = require("fs");
-const migrate = require("node-pg-migrate").default;
 
-const sm = new SecretsManagerClient();
+// SDK v3 already reuses TLS connections (keep-alive is on by default);
+// cap retries so a failing Secrets Manager call surfaces quickly
+const sm = new SecretsManagerClient({ maxAttempts: 2, retryMode: "standard" });
 
-async function getSecret(name) {
-  const data = await sm.send(new GetSecretValueCommand({ SecretId: name }));
-  return JSON.parse(data.SecretString);
+// Admin connection kept at module scope so warm invocations reuse it
+let adminClient = null;
+
+async function getAdminClient(db) {
+  if (adminClient) return adminClient;
+  const client = new Client({
+    user: db.username,
+    password: db.password,
+    host: db.host,
+    database: db.dbname, // target DB
+    port: db.port || 5432,
+    ssl: db.ssl || undefined, // set true or config if needed
+  });
+  // Drop the cached client if the connection breaks between invocations
+  client.on("error", (err) => {
+    console.error("Admin DB connection error:", err.message);
+    if (adminClient === client) adminClient = null;
+  });
+  await client.connect();
+  adminClient = client;
+  return adminClient;
+}
+
+// Secret lookups memoized per container; failed lookups are evicted so the
+// next invocation retries (e.g. after a rotation)
+const secretCache = new Map();
+
+function getSecret(name) {
+  if (!secretCache.has(name)) {
+    const pending = sm
+      .send(new GetSecretValueCommand({ SecretId: name }))
+      .then((data) => JSON.parse(data.SecretString))
+      .catch((err) => {
+        secretCache.delete(name);
+        throw err;
+      });
+    secretCache.set(name, pending);
+  }
+  return secretCache.get(name);
 }
 
 async function putSecret(name, secret) {
@@ -23,118 +60,115 @@ async function putSecret(name, secret) {
       SecretString: JSON.stringify(secret),
     })
   );
+  secretCache.set(name, Promise.resolve(secret));
 }
 
-async function fixMigrationTracking(db) {
-  const client = new Client({
-    user: db.username,
-    password: db.password,
-    host: db.host,
-    database: db.dbname,
-    port: db.port || 5432,
+// Migration files are fixed for the lifetime of the container, so list them
+// once at load rather than on every invocation
+const MIGRATIONS_DIR = path.join(__dirname, "migrations");
+const MIGRATION_NAMES = fs
+  .readdirSync(MIGRATIONS_DIR)
+  .filter((file) => file.endsWith(".js"))
+  .map((file) => path.basename(file, ".js"))
+  .sort();
+
+// Migrations that predate pgmigrations tracking; built once at load
+const BASELINE_MIGRATIONS = Object.freeze([
+  '1704110400000_create_extensions_and_users',
+  '1704110460000_create_simulation_groups',
+  '1704110520000_create_patients',
+  '1704110580000_create_enrolments',
+  '1704110640000_create_patient_data',
+  '1704110700000_create_student_interactions',
+  '1704110760000_create_sessions',
+  '1704110820000_create_messages',
+  '1704110880000_create_user_engagement_log',
+  '1704110940000_create_feedback',
+  '1704111000000_create_system_prompt_history',
+  '1704111060000_add_vector_extension',
+  '1704111120000_add_voice_toggles',
+  '1704111180000_create_empathy_prompt_history'
+]);
+
+const CREATE_MIGRATIONS_TABLE_SQL = `
+  CREATE TABLE IF NOT EXISTS pgmigrations (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    run_on TIMESTAMP NOT NULL DEFAULT NOW()
+  );
+`;
+
+// Set once the pgmigrations table is known to exist, so warm invocations
+// leave the DDL out of the bookkeeping batch
+let migrationsTableReady = false;
+
+async function fixMigrationTracking(client) {
+  // node-postgres can't pipeline, but a parameterless multi-statement
+  // query goes out in one simple-protocol message: ensure the tracking
+  // table, probe the core tables and read the applied names in a single
+  // round-trip. to_regclass avoids the joins behind information_schema.
+  const results = await client.query({
+    text: `
+      ${migrationsTableReady ? "" : CREATE_MIGRATIONS_TABLE_SQL}
+      SELECT
+        to_regclass('public.users') IS NOT NULL
+          AND to_regclass('public.simulation_groups') IS NOT NULL
+          AND to_regclass('public.patients') IS NOT NULL
+          AND to_regclass('public.messages') IS NOT NULL;
+      SELECT name FROM pgmigrations;
+    `,
+    // rowMode "array" skips building a keyed object for every row
+    rowMode: "array",
   });
-  await client.connect();
+  migrationsTableReady = true;
 
-  // Create pgmigrations table if it doesn't exist
-  await client.query(`
-    CREATE TABLE IF NOT EXISTS pgmigrations (
-      id SERIAL PRIMARY KEY,
-      name VARCHAR(255) NOT NULL,
-      run_on TIMESTAMP NOT NULL DEFAULT NOW()
-    )
-  `);
-
-  // Check if key tables exist to determine if migrations have run
-  const tablesExist = await client.query(`
-    SELECT table_name FROM information_schema.tables 
-    WHERE table_schema = 'public' 
-    AND table_name IN ('users', 'simulation_groups', 'patients', 'messages')
-  `);
+  const [coreTables, recorded] = results.slice(-2);
+  const hasCoreTables = coreTables.rows[0][0];
+  const applied = new Set(recorded.rows.map(([name]) => name));
 
   // If core tables exist, mark basic migrations as complete
-  if (tablesExist.rows.length >= 4) {
+  if (hasCoreTables) {
     console.log('Core tables exist, marking basic migrations as complete');
-    const basicMigrations = [
-      '1704110400000_create_extensions_and_users',
-      '1704110460000_create_simulation_groups', 
-      '1704110520000_create_patients',
-      '1704110580000_create_enrolments',
-      '1704110640000_create_patient_data',
-      '1704110700000_create_student_interactions',
-      '1704110760000_create_sessions',
-      '1704110820000_create_messages',
-      '1704110880000_create_user_engagement_log',
-      '1704110940000_create_feedback',
-      '1704111000000_create_system_prompt_history',
-      '1704111060000_add_vector_extension',
-      '1704111120000_add_voice_toggles',
-      '1704111180000_create_empathy_prompt_history'
-    ];
-    
-    for (const migration of basicMigrations) {
-      // Check if migration already exists before inserting
-      const exists = await client.query(`
-        SELECT 1 FROM pgmigrations WHERE name = $1
-      `, [migration]);
-      
-      if (exists.rows.length === 0) {
-        await client.query(`
-          INSERT INTO pgmigrations (name, run_on) VALUES ($1, NOW())
-        `, [migration]);
-      }
+    // Record all missing baseline migrations with one multi-row INSERT
+    const missing = BASELINE_MIGRATIONS.filter((name) => !applied.has(name));
+    if (missing.length > 0) {
+      await client.query(`
+        INSERT INTO pgmigrations (name, run_on)
+        SELECT name, NOW() FROM unnest($1::varchar[]) AS name
+      `, [missing]);
+      missing.forEach((name) => applied.add(name));
     }
   }
 
-  await client.end();
+  return applied;
 }
 
-async function runMigrations(db) {
-  const dbUrl = `postgresql://${encodeURIComponent(
-    db.username
-  )}:${encodeURIComponent(db.password)}@${db.host}:${db.port || 5432}/${
-    db.dbname
-  }`;
+async function runMigrations(client, applied) {
+  // Skip node-pg-migrate entirely when every migration file is recorded
+  if (MIGRATION_NAMES.every((name) => applied.has(name))) {
+    console.log("No pending migrations");
+    return;
+  }
+
+  // node-pg-migrate is only needed here, so load it on first use
+  const migrate = require("node-pg-migrate").default;
   await migrate({
-    databaseUrl: dbUrl,
-    dir: path.join(__dirname, "migrations"),
+    dbClient: client,
+    dir: MIGRATIONS_DIR,
     direction: "up",
     count: Infinity,
     migrationsTable: "pgmigrations",
+    // Apply every pending migration in one transaction (one commit)
+    singleTransaction: true,
     logger: console,
+    // Echoing every executed SQL statement is opt-in
+    verbose: process.env.DEBUG_MIGRATIONS === "1",
     createSchema: false,
   });
 }
 
-async function ensureBaselineOrMigrate(db) {
-  await runMigrations(db);
-}
-
-async function createAppUsers(
-  adminDb,
-  dbSecretName,
-  userSecretName,
-  proxySecretName
-) {
-  const adminClient = new Client({
-    user: adminDb.username,
-    password: adminDb.password,
-    host: adminDb.host,
-    database: adminDb.dbname, // target DB
-    port: adminDb.port || 5432,
-    ssl: adminDb.ssl || undefined, // set true or config if needed
-  });
-  await adminClient.connect();
-
-  // Stable usernames; rotate passwords idempotently
-  const RW_NAME = "app_rw";
-  const TC_NAME = "app_tc";
-  const rwPass = crypto.randomBytes(16).toString("hex");
-  const tcPass = crypto.randomBytes(16).toString("hex");
-
-  // Safe quoting for DB identifier inside SQL
-  const dbIdent = adminDb.dbname.replace(/"/g, '""');
-
-  const sql = `
+// Static parts of the role setup, built once at load
+const CREATE_GROUP_ROLES_SQL = `
     DO $$
     BEGIN
       IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'readwrite') THEN
@@ -144,10 +178,9 @@ async function createAppUsers(
         CREATE ROLE tablecreator;
       END IF;
     END$$;
+`;
 
-    GRANT CONNECT ON DATABASE "${dbIdent}" TO readwrite;
-    GRANT CONNECT ON DATABASE "${dbIdent}" TO tablecreator;
-
+const GROUP_ROLE_PRIVILEGES_SQL = `
     GRANT USAGE ON SCHEMA public TO readwrite;
     GRANT USAGE ON SCHEMA public TO tablecreator;
     GRANT CREATE ON SCHEMA public TO tablecreator;
@@ -163,6 +196,40 @@ async function createAppUsers(
 
     ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT USAGE ON SEQUENCES TO readwrite;
     ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT USAGE ON SEQUENCES TO tablecreator;
+`;
+
+async function createAppUsers(
+  adminClient,
+  adminDb,
+  dbSecretName,
+  userSecretName,
+  proxySecretName
+) {
+  // Stable usernames; keep the passwords already stored in the secrets so
+  // re-runs don't rotate credentials and rewrite both secrets every time
+  const RW_NAME = "app_rw";
+  const TC_NAME = "app_tc";
+  const userSecret = await getSecret(userSecretName);
+  const proxySecret = await getSecret(proxySecretName);
+  const credentialsExist =
+    userSecret.username === RW_NAME && proxySecret.username === TC_NAME;
+  const rwPass = credentialsExist
+    ? userSecret.password
+    : crypto.randomBytes(16).toString("hex");
+  const tcPass = credentialsExist
+    ? proxySecret.password
+    : crypto.randomBytes(16).toString("hex");
+
+  // Safe quoting for DB identifier inside SQL
+  const dbIdent = adminDb.dbname.replace(/"/g, '""');
+
+  const sql = `
+    ${CREATE_GROUP_ROLES_SQL}
+
+    GRANT CONNECT ON DATABASE "${dbIdent}" TO readwrite;
+    GRANT CONNECT ON DATABASE "${dbIdent}" TO tablecreator;
+
+    ${GROUP_ROLE_PRIVILEGES_SQL}
 
     DO $$
     BEGIN
@@ -183,41 +250,66 @@ async function createAppUsers(
     GRANT tablecreator TO ${TC_NAME};
   `;
 
-  await adminClient.query("BEGIN");
-  try {
-    await adminClient.query(sql);
-    await adminClient.query("COMMIT");
-  } catch (e) {
-    await adminClient.query("ROLLBACK");
-    throw e;
-  } finally {
-    await adminClient.end();
+  // Sent as one simple-protocol query: Postgres runs a multi-statement
+  // query string as a single implicit transaction, so no BEGIN/COMMIT
+  // round-trips are needed and any failure rolls the whole script back.
+  // Kept on one connection on purpose: splitting the two user blocks across
+  // connections would cost a second handshake for a single round-trip, and
+  // concurrent GRANTs on the shared roles can fail with "tuple concurrently
+  // updated".
+  await adminClient.query(sql);
+
+  if (credentialsExist) {
+    console.log("App user credentials already provisioned, skipping secret update");
+    return;
   }
 
-  // Update Secrets Manager with the rotated creds
+  // Update Secrets Manager with the new creds; the two writes are
+  // independent, so issue them concurrently with separate payloads
   const base = await getSecret(dbSecretName);
-  await putSecret(proxySecretName, {
-    ...base,
-    username: TC_NAME,
-    password: tcPass,
-  });
-  await putSecret(userSecretName, {
-    ...base,
-    username: RW_NAME,
-    password: rwPass,
-  });
+  await Promise.all([
+    putSecret(proxySecretName, {
+      ...base,
+      username: TC_NAME,
+      password: tcPass,
+    }),
+    putSecret(userSecretName, {
+      ...base,
+      username: RW_NAME,
+      password: rwPass,
+    }),
+  ]);
 }
 
 exports.handler = async function () {
   const { DB_SECRET_NAME, DB_USER_SECRET_NAME, DB_PROXY } = process.env;
-  const adminDb = await getSecret(DB_SECRET_NAME);
-  
-  // Fix migration tracking first
-  await fixMigrationTracking(adminDb);
-  
-  // Then run any new migrations
-  await ensureBaselineOrMigrate(adminDb);
-  
-  await createAppUsers(adminDb, DB_SECRET_NAME, DB_USER_SECRET_NAME, DB_PROXY);
-  return { status: "ok" };
-};
\ No newline at end of file
+  try {
+    // Fetch all three secrets concurrently; createAppUsers later reads the
+    // user and proxy secrets from the memoized cache
+    const [adminDb] = await Promise.all([
+      getSecret(DB_SECRET_NAME),
+      getSecret(DB_USER_SECRET_NAME),
+      getSecret(DB_PROXY),
+    ]);
+    const client = await getAdminClient(adminDb);
+
+    // Fix migration tracking first; returns the recorded migration names
+    const applied = await fixMigrationTracking(client);
+
+    // Then run any new migrations
+    await runMigrations(client, applied);
+
+    await createAppUsers(client, adminDb, DB_SECRET_NAME, DB_USER_SECRET_NAME, DB_PROXY);
+    return { status: "ok" };
+  } catch (err) {
+    console.error("db_setup handler failed:", err);
+    // Don't hand a connection in an unknown state to the next invocation
+    if (adminClient) {
+      adminClient.end().catch(() => {});
+      adminClient = null;
+    }
+    // Re-read secrets on retry in case a stale (e.g. rotated) password caused the failure
+    secretCache.clear();
+    throw err;
+  }
+};
@@ -15,8 +15,10 @@ const studentEmpathySummary = async (event, sqlConnection) => {
   try {
     // First check if empathy_evaluation column exists
     const columnCheck = await sqlConnection`
-      SELECT column_name FROM information_schema.columns 
-      WHERE table_name = 'messages' AND column_name = 'empathy_evaluation';
+      SELECT attname AS column_name FROM pg_attribute
+      WHERE attrelid = to_regclass('messages')
+        AND attname = 'empathy_evaluation'
+        AND NOT attisdropped;
     `;
 
     if (columnCheck.length === 0) {
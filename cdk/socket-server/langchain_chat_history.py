@@ -1,30 +1,44 @@
 import json
-import os
+import boto3
 from langchain_community.chat_message_histories import DynamoDBChatMessageHistory
 from langchain_core.messages import AIMessage, HumanMessage
-import psycopg2
 import logging
-import boto3
-import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from voice_db_manager import get_pg_connection, return_pg_connection
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-connection = None
-db_secret = None
+# Runs the PostgreSQL mirror insert alongside the DynamoDB write
+pg_insert_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pg-insert")
 
-secrets_manager_client = boto3.client("secretsmanager")
+# boto3 sessions and resources are not thread-safe, and history calls arrive from several
+# executor threads, so each thread keeps its own session and histories
+thread_histories = threading.local()
 
-RDS_PROXY_ENDPOINT = os.environ.get("RDS_PROXY_ENDPOINT")  # Replace with your actual RDS proxy endpoint
-DB_SECRET_NAME = os.environ.get("SM_DB_CREDENTIALS")  # Replace with your actual secret name
-print(f"Using RDS Proxy Endpoint: {RDS_PROXY_ENDPOINT}")
-logger.info(f"Using RDS Proxy Endpoint: {RDS_PROXY_ENDPOINT}")
+def get_history(session_id: str, table_name: str) -> DynamoDBChatMessageHistory:
+    """One history (and boto3 DynamoDB resource) per session per thread instead of per call"""
+    histories = getattr(thread_histories, "histories", None)
+    if histories is None:
+        histories = thread_histories.histories = {}
+        # The default boto3 session is shared process-wide, so build resources from a thread-local one
+        thread_histories.session = boto3.session.Session()
+    key = (session_id, table_name)
+    history = histories.get(key)
+    if history is None:
+        history = histories[key] = DynamoDBChatMessageHistory(
+            table_name=table_name,
+            session_id=session_id,
+            boto3_session=thread_histories.session,
+        )
+    return history
 
 def format_chat_history(session_id: str, table_name: str = "DynamoDB-Conversation-Table") -> str:
-    history = DynamoDBChatMessageHistory(table_name=table_name, session_id=session_id)
+    history = get_history(session_id, table_name)
     recent_messages = history.messages[-10:]
 
     lines = []
@@ -36,72 +50,39 @@ def format_chat_history(session_id: str, table_name: str = "DynamoDB-Conversatio
     return "\n".join(lines)
 
 def add_message(session_id: str, role: str, content: str, table_name: str = "DynamoDB-Conversation-Table"):
-    history = DynamoDBChatMessageHistory(table_name=table_name, session_id=session_id)
     if role == "user":
-        history.add_message(HumanMessage(content=content))
+        message = HumanMessage(content=content)
     elif role == "ai":
-        history.add_message(AIMessage(content=content))
+        message = AIMessage(content=content)
     else:
         raise ValueError(f"Invalid role '{role}'. Must be 'user' or 'ai'.")
 
-    # Mirror to PostgreSQL
+    # Mirror to PostgreSQL while DynamoDB is written, then wait for both
+    pg_insert = pg_insert_executor.submit(insert_message_to_postgres, session_id, role, content)
     try:
-        insert_message_to_postgres(session_id, role, content)
-    
-    except Exception as e:
-        logger.error(f"❌ Failed to insert message into PostgreSQL: {e}")
-
-
-def get_secret(secret_name, expect_json=True):
-    global db_secret
-    if db_secret is None:
+        get_history(session_id, table_name).add_message(message)
+    finally:
         try:
-            response = secrets_manager_client.get_secret_value(SecretId=secret_name)["SecretString"]
-            db_secret = json.loads(response) if expect_json else response
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to decode JSON for secret: {e}")
-            raise ValueError(f"Secret {secret_name} is not properly formatted as JSON.")
+            pg_insert.result()
         except Exception as e:
-            logger.error(f"Error fetching secret: {e}")
-            raise
-    return db_secret
+            logger.error(f"❌ Failed to insert message into PostgreSQL: {e}")
 
-def connect_to_db():
-    global connection
-    if connection is None or connection.closed:
-        try:
-            secret = get_secret(DB_SECRET_NAME)
-            connection_params = {
-                'dbname': secret["dbname"],
-                'user': secret["username"],
-                'password': secret["password"],
-                'host': RDS_PROXY_ENDPOINT,
-                'port': secret["port"]
-            }
-            connection_string = " ".join([f"{key}={value}" for key, value in connection_params.items()])
-            connection = psycopg2.connect(connection_string)
-            logger.info("Connected to the database!")
-        except Exception as e:
-            logger.error(f"Failed to connect to database: {e}")
-            if connection:
-                connection.rollback()
-                connection.close()
-            raise
-    return connection
+
+# message_id comes from the column default (uuid_generate_v4), so the client never builds one.
+# Plain parameterized SQL: a session-level PREPARE would pin the RDS Proxy connection.
+INSERT_MESSAGE = """
+    INSERT INTO messages (session_id, student_sent, message_content, time_sent)
+    VALUES (%s, %s, %s, %s);
+"""
 
 def insert_message_to_postgres(session_id: str, role: str, content: str):
+    conn = None
     try:
-        conn = connect_to_db()
+        conn = get_pg_connection()
         cursor = conn.cursor()
-
-        insert_query = """
-            INSERT INTO messages (message_id, session_id, student_sent, message_content, time_sent)
-            VALUES (%s, %s, %s, %s, %s);
-        """
-        cursor.execute(insert_query, (
-            str(uuid.uuid4()),
+        cursor.execute(INSERT_MESSAGE, (
             session_id,
-            True if role == "user" else False,
+            role == "user",
             content,
             datetime.utcnow()
         ))
@@ -112,5 +93,9 @@ def insert_message_to_postgres(session_id: str, role: str, content: str):
     except Exception as e:
         logger.error(f"❌ Failed to insert message: {e}")
         print(f"❌ Failed to insert message: {e}")
-        conn.rollback()
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            return_pg_connection(conn)
 
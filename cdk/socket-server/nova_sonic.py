@@ -1,24 +1,31 @@
 import os
 import sys
 import asyncio
-import base64
+import pybase64 as base64  # SIMD drop-in for the stdlib base64 API
 import json
+import orjson
 import uuid
 import random
+import collections
+import uvloop
 import boto3
 import botocore
 from aws_sdk_bedrock_runtime.client import BedrockRuntimeClient, InvokeModelWithBidirectionalStreamOperationInput
 from aws_sdk_bedrock_runtime.models import InvokeModelWithBidirectionalStreamInputChunk, BidirectionalInputPayloadPart
 from aws_sdk_bedrock_runtime.config import Config
+from smithy_core.interceptors import Interceptor
+from smithy_http import Field
 import langchain_chat_history
 import psycopg2
 from psycopg2 import pool
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import logging
 import requests
 from langchain_community.embeddings import BedrockEmbeddings
 from langchain_community.vectorstores import PGVector
-from voice_db_manager import voice_db_manager, get_pg_connection, return_pg_connection
+from voice_db_manager import voice_db_manager, get_pg_connection, return_pg_connection, get_db_secret
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +37,128 @@ INPUT_SAMPLE_RATE = 16000
 OUTPUT_SAMPLE_RATE = 24000
 CHANNELS = 1
 CHUNK_SIZE = 1024
+# Coalesce smaller inbound PCM chunks into one audioInput event of at least this many bytes
+AUDIO_BATCH_BYTES = int(os.getenv("AUDIO_BATCH_BYTES", "4096"))
+# ...or once the oldest coalesced byte has waited this many seconds
+AUDIO_FLUSH_DELAY = float(os.getenv("AUDIO_FLUSH_DELAY", "0.08"))
+
+# Session-level events never change, so serialize them once
+SESSION_START_EVENT = orjson.dumps({
+    "event": {
+        "sessionStart": {
+            "inferenceConfiguration": {
+                "maxTokens": 2048,
+                "topP": 1.0,
+                "temperature": 0.8,
+                "stopSequences": []
+            }
+        }
+    }
+})
+SESSION_END_EVENT = orjson.dumps({"event": {"sessionEnd": {}}})
+
+# Closes the audioInput envelope at the start of NovaSonic._audio_frame
+AUDIO_INPUT_SUFFIX = b'"}}}'
+BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+
+VOICE_IDS = {"feminine": ["amy", "tiffany", "lupe"], "masculine": ["matthew", "carlos"]}
+
+# Audio output line for server.js; base64 needs no JSON escaping, so it is spliced in as-is
+AUDIO_OUTPUT_TEMPLATE = b'{"type":"audio","data":"%s","size":%d}\n'
+STDOUT = sys.stdout.buffer
+_stdout_flush_scheduled = False
+
+# promptStart with %s slots for the JSON-encoded promptName and voiceId
+PROMPT_START_TEMPLATE = (
+    b'{"event":{"promptStart":{"promptName":%s,'
+    b'"textOutputConfiguration":{"mediaType":"text/plain"},'
+    b'"audioOutputConfiguration":{"mediaType":"audio/lpcm","sampleRateHertz":24000,'
+    b'"sampleSizeBits":16,"channelCount":1,"voiceId":%s,"encoding":"base64","audioType":"SPEECH"}}}}'
+)
+
+# Audio content block events with %s slots for the JSON-encoded promptName and contentName
+AUDIO_CONTENT_START_TEMPLATE = (
+    b'{"event":{"contentStart":{"promptName":%s,"contentName":%s,"type":"AUDIO",'
+    b'"interactive":true,"role":"USER","audioInputConfiguration":{"mediaType":"audio/lpcm",'
+    b'"sampleRateHertz":16000,"sampleSizeBits":16,"channelCount":1,"audioType":"SPEECH","encoding":"base64"}}}}'
+)
+AUDIO_CONTENT_END_TEMPLATE = b'{"event":{"contentEnd":{"promptName":%s,"contentName":%s}}}'
+AUDIO_INPUT_PREFIX_TEMPLATE = b'{"event":{"audioInput":{"promptName":%s,"contentName":%s,"content":"'
+
+# Stdin pipe reads land in one reused buffer; reading pauses while this many commands queue up
+STDIN_BUFFER_SIZE = 64 * 1024
+STDIN_MAX_PENDING_LINES = 256
+
+# Seconds end_session waits for trailing model output before cancelling the response task
+RESPONSE_DRAIN_TIMEOUT = 2.0
+
+# Single writer thread keeps transcript mirror inserts in arrival order off the event loop
+PG_MIRROR_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pg-mirror")
+
+# Verbose per-event tracing on stdout; off by default so hot paths skip it
+NOVA_DEBUG = os.getenv("NOVA_DEBUG", "false").lower() == "true"
+
+# Bedrock inference latency profile: "optimized" opts in, anything else keeps standard
+BEDROCK_LATENCY = os.getenv("BEDROCK_LATENCY", "standard").lower()
+
+
+
+def emit(message: dict):
+    """Write one NDJSON message for server.js on stdout"""
+    STDOUT.write(orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE))
+    STDOUT.flush()
+
+def emit_audio(b64: bytes, size: int):
+    """Write one audio message, splicing the base64 into a fixed NDJSON template"""
+    global _stdout_flush_scheduled
+    STDOUT.write(AUDIO_OUTPUT_TEMPLATE % (b64, size))
+    # Audio written during the same loop pass goes out with a single flush
+    if not _stdout_flush_scheduled:
+        _stdout_flush_scheduled = True
+        asyncio.get_running_loop().call_soon(_flush_stdout)
+
+def _flush_stdout():
+    global _stdout_flush_scheduled
+    _stdout_flush_scheduled = False
+    STDOUT.flush()
+
+
+class LatencyOptimizedInterceptor(Interceptor):
+    """Ask Bedrock for latency-optimized inference on every request"""
+
+    def modify_before_signing(self, context):
+        request = context.transport_request
+        request.fields.set_field(
+            Field(name="X-Amzn-Bedrock-PerformanceConfig-Latency", values=["optimized"])
+        )
+        return request
+
+
+@lru_cache(maxsize=None)
+def get_bedrock_runtime_client(region: str) -> BedrockRuntimeClient:
+    """One Bedrock client per region for the process, shared by every session"""
+    # Use AWS recommended approach with updated import for EnvironmentCredentialsResolver
+    from smithy_aws_core.identity.environment import EnvironmentCredentialsResolver
+
+    # server.js sets the STS credentials in our env at spawn, so the resolver's cached identity stays valid
+    config = Config(
+        endpoint_uri=f"https://bedrock-runtime.{region}.amazonaws.com",
+        region=region,
+        aws_credentials_identity_resolver=EnvironmentCredentialsResolver(),
+        interceptors=[LatencyOptimizedInterceptor()] if BEDROCK_LATENCY == "optimized" else [],
+    )
+    return BedrockRuntimeClient(config=config)
+
+
+@lru_cache(maxsize=None)
+def get_bedrock_invoke_client(region: str):
+    """One boto3 bedrock-runtime client per region for the process.
+
+    Only ever called from the event loop thread: creating clients from boto3's
+    shared default session on several threads at once is not safe, while the
+    finished client is safe to use from worker threads.
+    """
+    return boto3.client("bedrock-runtime", region_name=region)
 
 
 class NovaSonic:
@@ -47,13 +176,21 @@ class NovaSonic:
         self.stream = None
         self.response = None
         self.is_active = False
-        self.prompt_name = str(uuid.uuid4())
-        self.content_name = str(uuid.uuid4())
-        self.audio_content_name = str(uuid.uuid4())
-        self.audio_queue = asyncio.Queue()
+        # One CSPRNG read for all three names, kept in the usual UUID4 form
+        rb = os.urandom(48)
+        self.prompt_name = str(uuid.UUID(bytes=rb[:16], version=4))
+        self.content_name = str(uuid.UUID(bytes=rb[16:32], version=4))
+        self.audio_content_name = str(uuid.UUID(bytes=rb[32:], version=4))
+        self._build_static_events()
+        self._build_audio_content_events()
+        self._pending_audio = bytearray()
+        self._audio_flush_handle = None
+        self._audio_flush_task = None
         self.role = None
         self.display_assistant_text = False
         self.voice_id = voice_id
+        # Use the voice ID from frontend if provided, otherwise select a random feminine voice
+        self.voice = voice_id or random.choice(VOICE_IDS["feminine"])
         self.session_id = session_id or os.getenv("SESSION_ID", "default")
         self.patient_name = os.getenv("PATIENT_NAME", "")
         self.patient_prompt = os.getenv("PATIENT_PROMPT", "")
@@ -65,35 +202,78 @@ class NovaSonic:
         self._bedrock_client = None
         self._chat_context = None
         self._current_user_input = ""
+        # Response event kind -> handler, resolved once per event in _handle_event
+        self._event_handlers = {
+            "contentStart": self._on_content_start,
+            "textOutput": self._on_text_output,
+            "audioOutput": self._on_audio_output,
+        }
 
     def _init_client(self):
         """Initialize the Bedrock Client for Nova"""
         try:
             print(f"🔧 Initializing Bedrock client for region: {self.region}", flush=True)
-            
-            # Use AWS recommended approach with updated import for EnvironmentCredentialsResolver
-            from smithy_aws_core.identity.environment import EnvironmentCredentialsResolver
-            
-            config = Config(
-                endpoint_uri=f"https://bedrock-runtime.{self.region}.amazonaws.com",
-                region=self.region,
-                aws_credentials_identity_resolver=EnvironmentCredentialsResolver(),
-            )
-            
-            self.client = BedrockRuntimeClient(config=config)
+            self.client = get_bedrock_runtime_client(self.region)
             print(f"✅ Initialized Bedrock client for model {self.model_id} in region {self.region}", flush=True)
         except Exception as e:
             print(f"❌ Failed to initialize Bedrock client: {e}", flush=True)
             raise e
 
+    def _build_static_events(self):
+        """Pre-serialize the events that depend only on the prompt/content names"""
+        self._prompt_name_json = orjson.dumps(self.prompt_name)
+        self._system_content_start_event = orjson.dumps({
+            "event": {
+                "contentStart": {
+                    "promptName": self.prompt_name,
+                    "contentName": self.content_name,
+                    "type": "TEXT",
+                    "interactive": True,
+                    "role": "SYSTEM",
+                    "interrupt": True,
+                    "textInputConfiguration": {
+                        "mediaType": "text/plain"
+                    }
+                }
+            }
+        })
+        self._system_content_end_event = orjson.dumps({
+            "event": {
+                "contentEnd": {
+                    "promptName": self.prompt_name,
+                    "contentName": self.content_name
+                }
+            }
+        })
+        self._prompt_end_event = orjson.dumps({
+            "event": {
+                "promptEnd": {"promptName": self.prompt_name}
+            }
+        })
+
+    def _build_audio_content_events(self):
+        """Fill the audio content templates for the current audio content block"""
+        names = (self._prompt_name_json, orjson.dumps(self.audio_content_name))
+        self._audio_content_start_event = AUDIO_CONTENT_START_TEMPLATE % names
+        self._audio_content_end_event = AUDIO_CONTENT_END_TEMPLATE % names
+        # audioInput is this envelope + base64 content + AUDIO_INPUT_SUFFIX, assembled
+        # in one reused frame buffer that always starts with the envelope prefix
+        prefix = AUDIO_INPUT_PREFIX_TEMPLATE % names
+        self._audio_frame = bytearray(prefix)
+        self._audio_prefix_len = len(prefix)
+
     async def send_event(self, event: dict):
         """
         Given a Python dict, serialize it _without_ leading/trailing
         whitespace and send exactly one JSON object per chunk.
+        orjson emits compact UTF-8 bytes directly, so no extra encode step.
         """
-        payload = json.dumps(event, separators=(",", ":"))
+        await self.send_event_bytes(orjson.dumps(event))
+
+    async def send_event_bytes(self, payload: bytes):
+        """Send one already-serialized JSON event"""
         chunk = InvokeModelWithBidirectionalStreamInputChunk(
-            value=BidirectionalInputPayloadPart(bytes_=payload.encode("utf-8"))
+            value=BidirectionalInputPayloadPart(bytes_=payload)
         )
         await self.stream.input_stream.send(chunk)
 
@@ -192,71 +372,22 @@ Never provide medical advice, diagnoses, or pharmaceutical recommendations. Alwa
 
         # Send session start event
         # 1) sessionStart
-        await self.send_event({
-        "event": {
-            "sessionStart": {
-            "inferenceConfiguration": {
-                "maxTokens": 2048,
-                "topP": 1.0,
-                "temperature": 0.8,
-                "stopSequences": []
-            }
-            }
-        }
-        })
+        await self.send_event_bytes(SESSION_START_EVENT)
 
-        # Send prompt start event
-        voice_ids = {"feminine": ["amy", "tiffany", "lupe"], "masculine": ["matthew", "carlos"]}
-        
-        # Use the voice ID from frontend if provided, otherwise select a random feminine voice
-        selected_voice = self.voice_id if self.voice_id else random.choice(voice_ids['feminine'])
-        
         # 2) promptStart
-        await self.send_event({
-        "event": {
-            "promptStart": {
-            "promptName": self.prompt_name,
-            "textOutputConfiguration": {
-                "mediaType": "text/plain"
-            },
-            "audioOutputConfiguration": {
-                "mediaType": "audio/lpcm",
-                "sampleRateHertz": 24000,
-                "sampleSizeBits": 16,
-                "channelCount": 1,
-                "voiceId": selected_voice,
-                "encoding": "base64",
-                "audioType": "SPEECH"
-            }
-            }
-        }
-        })
+        await self.send_event_bytes(
+            PROMPT_START_TEMPLATE % (self._prompt_name_json, orjson.dumps(self.voice))
+        )
 
         # 3) SYSTEM contentStart
-        await self.send_event({
-        "event": {
-            "contentStart": {
-            "promptName": self.prompt_name,
-            "contentName": self.content_name,
-            "type": "TEXT",
-            "interactive": True,
-            "role": "SYSTEM",
-            "interrupt": True,
-            "textInputConfiguration": {
-                "mediaType": "text/plain"
-            }
-            }
-        }
-        })
+        await self.send_event_bytes(self._system_content_start_event)
 
         # Cache chat context to avoid repeated DB calls
         if not self._chat_context:
             self._chat_context = langchain_chat_history.format_chat_history(self.session_id)
 
-        system_prompt = f"""
-                        {self.get_system_prompt()}
-                        {self._chat_context}
-                        """
+        # Plain join: the old indented f-string sent the indentation along with the prompt
+        system_prompt = f"{self.get_system_prompt().strip()}\n{self._chat_context}"
         
         # 4) textInput (your system prompt)
         await self.send_event({
@@ -270,69 +401,82 @@ Never provide medical advice, diagnoses, or pharmaceutical recommendations. Alwa
         })
 
         # 5) contentEnd
-        await self.send_event({
-        "event": {
-            "contentEnd": {
-            "promptName": self.prompt_name,
-            "contentName": self.content_name
-            }
-        }
-        })
+        await self.send_event_bytes(self._system_content_end_event)
 
         # Start processing responses
         self.response = asyncio.create_task(self._process_responses())
 
         print(f"✅ Nova Sonic session started (Prompt ID: {self.prompt_name})", flush=True)
-        print(json.dumps({ "type": "text", "text": "Nova Sonic ready" }), flush=True)
+        emit({"type": "text", "text": "Nova Sonic ready"})
 
     async def start_audio_input(self):
+        # Leftover coalesced audio belongs to the previous content block, so send it under that name
+        await self.flush_audio()
         self.audio_content_name = str(uuid.uuid4())
         self._current_user_input = ""  # Track user input for empathy evaluation
-        await self.send_event({
-        "event": {
-            "contentStart": {
-            "promptName": self.prompt_name,
-            "contentName": self.audio_content_name,
-            "type": "AUDIO",
-            "interactive": True,
-            "role": "USER",
-            "audioInputConfiguration": {
-                "mediaType": "audio/lpcm",
-                "sampleRateHertz": INPUT_SAMPLE_RATE,
-                "sampleSizeBits": 16,
-                "channelCount": CHANNELS,
-                "audioType": "SPEECH",
-                "encoding": "base64"
-            }
-            }
-        }
-        })
+        self._build_audio_content_events()
+        await self.send_event_bytes(self._audio_content_start_event)
     
     async def send_audio_chunk(self, audio_bytes):
-        blob = base64.b64encode(audio_bytes).decode("utf-8")
-        await self.send_event({
-        "event": {
-            "audioInput": {
-            "promptName": self.prompt_name,
-            "contentName": self.audio_content_name,
-            "content": blob
-            }
-        }
-        })
+        self._pending_audio += audio_bytes
+        if len(self._pending_audio) >= AUDIO_BATCH_BYTES:
+            await self.flush_audio()
+        elif self._audio_flush_handle is None:
+            # Bound the latency a partial batch can add
+            self._audio_flush_handle = asyncio.get_running_loop().call_later(
+                AUDIO_FLUSH_DELAY, self._flush_audio_later
+            )
+
+    def _flush_audio_later(self):
+        self._audio_flush_handle = None
+        self._audio_flush_task = asyncio.create_task(self.flush_audio())
+        self._audio_flush_task.add_done_callback(self._audio_flush_done)
+
+    def _audio_flush_done(self, task):
+        if self._audio_flush_task is task:
+            self._audio_flush_task = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"❌ Delayed audio flush failed: {task.exception()}", flush=True)
+
+    async def send_audio_chunk_b64(self, blob):
+        """Forward a base64 PCM chunk, re-encoding only when it must be coalesced"""
+        if not self._pending_audio and len(blob) * 3 // 4 >= AUDIO_BATCH_BYTES:
+            data = blob.encode("ascii")
+            # Spliced into the event verbatim, so only base64 characters may pass
+            if data.translate(None, BASE64_ALPHABET):
+                raise ValueError("Audio chunk is not valid base64")
+            await self._send_audio_event(data)
+        else:
+            await self.send_audio_chunk(base64.b64decode(blob))
+
+    async def flush_audio(self):
+        """Send any coalesced audio as a single audioInput event"""
+        if self._audio_flush_handle is not None:
+            self._audio_flush_handle.cancel()
+            self._audio_flush_handle = None
+        if self._pending_audio:
+            data = base64.b64encode(self._pending_audio)
+            self._pending_audio.clear()
+            await self._send_audio_event(data)
+
+    async def _send_audio_event(self, data: bytes):
+        """Wrap base64 bytes in the pre-serialized audioInput envelope"""
+        frame = self._audio_frame
+        del frame[self._audio_prefix_len:]
+        frame += data
+        frame += AUDIO_INPUT_SUFFIX
+        # The event stream serializer copies the payload before send() returns,
+        # so the frame can be rewritten for the next chunk
+        await self.send_event_bytes(frame)
     
     async def end_audio_input(self):
-        await self.send_event({
-        "event": {
-            "contentEnd": {
-            "promptName": self.prompt_name,
-            "contentName": self.audio_content_name
-            }
-        }
-        })
+        await self.flush_audio()
+        await self.send_event_bytes(self._audio_content_end_event)
         
         # Trigger empathy evaluation for the completed user audio input if enabled
         if hasattr(self, '_current_user_input') and self._current_user_input and self._current_user_input.strip():
-            print(f"🔍 DEBUG: Audio ended, user input: {self._current_user_input[:50]}...", flush=True)
+            if NOVA_DEBUG:
+                print(f"🔍 DEBUG: Audio ended, user input: {self._current_user_input[:50]}...", flush=True)
             logger.info(f"🎤 AUDIO END - User input: {self._current_user_input[:30]}...")
             
             # Save user message to DB (CRITICAL for empathy coach review)
@@ -363,21 +507,37 @@ Never provide medical advice, diagnoses, or pharmaceutical recommendations. Alwa
             asyncio.create_task(safe_empathy_eval())
             
             self._current_user_input = ""  # Reset for next input
-        else:
+        elif NOVA_DEBUG:
             print(f"🔍 DEBUG: No user input to save at audio end", flush=True)
 
-    async def end_session(self):
+    async def end_session(self, drain=True):
+        # Settle coalesced audio before promptEnd. An in-flight flush is awaited rather than
+        # cancelled, since cancelling mid-send would break the signed event chain.
+        if self._audio_flush_handle is not None:
+            self._audio_flush_handle.cancel()
+            self._audio_flush_handle = None
+        if self._audio_flush_task is not None:
+            await asyncio.gather(self._audio_flush_task, return_exceptions=True)
+        await self.flush_audio()
+
         # promptEnd
-        await self.send_event({
-        "event": {
-            "promptEnd": { "promptName": self.prompt_name }
-        }
-        })
+        await self.send_event_bytes(self._prompt_end_event)
         # sessionEnd
-        await self.send_event({
-        "event": { "sessionEnd": {} }
-        })
+        await self.send_event_bytes(SESSION_END_EVENT)
         await self.stream.input_stream.close()
+
+        # Let the response task drain the final events, then stop it deterministically.
+        # A restart has no use for the old session's tail, so it stops the task right away.
+        if self.response and not drain:
+            self.response.cancel()
+            await asyncio.gather(self.response, return_exceptions=True)
+        elif self.response:
+            try:
+                async with asyncio.timeout(RESPONSE_DRAIN_TIMEOUT):
+                    await self.response
+            except TimeoutError:
+                self.response.cancel()
+        self.is_active = False
     
     async def handle_manual_empathy_evaluation(self, text, session_id=None):
         """Handle manual empathy evaluation requests from server.js"""
@@ -421,18 +581,29 @@ Never provide medical advice, diagnoses, or pharmaceutical recommendations. Alwa
                 if not (result.value and result.value.bytes_):
                     continue
 
+                # Fast path: Bedrock normally sends one whole JSON object per chunk,
+                # which orjson parses straight from the raw bytes
+                if not buffer:
+                    try:
+                        obj = orjson.loads(result.value.bytes_)
+                    except orjson.JSONDecodeError:
+                        pass
+                    else:
+                        await self._handle_event(obj)
+                        continue
+
                 # 1) Decode the raw bytes
                 chunk = result.value.bytes_.decode("utf-8")
                 buffer += chunk
 
-                # 2) Try to peel off as many complete JSON objects as possible
+                # 2) Try to peel off as many complete JSON objects as possible,
+                #    scanning forward from idx rather than re-slicing the buffer
                 idx = 0
                 while True:
                     try:
-                        obj, offset = decoder.raw_decode(buffer[idx:])
+                        obj, idx = decoder.raw_decode(buffer, idx)
                     except json.JSONDecodeError:
                         break
-                    idx += offset
                     # 3) Hand off each parsed object
                     await self._handle_event(obj)
 
@@ -443,106 +614,111 @@ Never provide medical advice, diagnoses, or pharmaceutical recommendations. Alwa
             print(f"🔥 Error in _process_responses(): {e}", flush=True)
 
     async def _handle_event(self, json_data):
-        """Dispatch one parsed JSON event to your existing logic."""
-        evt = json_data.get("event", {})
+        """Dispatch one parsed JSON event to its handler by event kind."""
+        for kind, payload in json_data.get("event", {}).items():
+            handler = self._event_handlers.get(kind)
+            if handler:
+                handler(payload)
+            break
+
+    def _on_content_start(self, content_start):
+        self.role = content_start.get("role")
+        # optional SPECULATIVE check
+        if "additionalModelFields" in content_start:
+            fields = orjson.loads(content_start["additionalModelFields"])
+            self.display_assistant_text = (fields.get("generationStage") == "SPECULATIVE")
+
+    def _on_text_output(self, text_output):
+        text = text_output["content"]
         
-        # contentStart
-        if "contentStart" in evt:
-            content_start = evt["contentStart"]
-            self.role = content_start.get("role")
-            # optional SPECULATIVE check
-            if "additionalModelFields" in content_start:
-                fields = json.loads(content_start["additionalModelFields"])
-                self.display_assistant_text = (fields.get("generationStage") == "SPECULATIVE")
-
-        # textOutput
-        elif "textOutput" in evt:
-            text = evt["textOutput"]["content"]
-            
-            # Filter only the specific interrupted JSON message
-            if text.strip() == '{"interrupted": true}':
-                print(f"Filtered interrupted message", flush=True)
-                return
+        # Filter only the specific interrupted JSON message
+        if text.strip() == '{"interrupted": true}':
+            print(f"Filtered interrupted message", flush=True)
+            return
+        
+        # Check for diagnosis completion
+        diagnosis_achieved = "SESSION COMPLETED" in text
+        if diagnosis_achieved and self.llm_completion:
+            # Remove the marker from the text
+            text = text.replace("SESSION COMPLETED", "").strip()
+            # Add completion message
+            text += " I really appreciate your feedback. You may continue practicing with other patients. Goodbye."
+        
+        if self.role == "ASSISTANT":
+            print(f"Assistant: {text}", flush=True)
+            emit({"type": "text", "text": text})
             
-            # Check for diagnosis completion
-            diagnosis_achieved = "SESSION COMPLETED" in text
+            # If diagnosis achieved, signal completion
             if diagnosis_achieved and self.llm_completion:
-                # Remove the marker from the text
-                text = text.replace("SESSION COMPLETED", "").strip()
-                # Add completion message
-                text += " I really appreciate your feedback. You may continue practicing with other patients. Goodbye."
-            
-            if self.role == "ASSISTANT":
-                print(f"Assistant: {text}", flush=True)
-                print(json.dumps({"type": "text", "text": text}), flush=True)
-                
-                # If diagnosis achieved, signal completion
-                if diagnosis_achieved and self.llm_completion:
-                    print(json.dumps({"type": "diagnosis_complete", "text": "Session completed successfully"}), flush=True)
+                emit({"type": "diagnosis_complete", "text": "Session completed successfully"})
 
-            elif self.role == "USER":
-                print(f"User: {text}", flush=True)
-                print(json.dumps({"type": "text", "text": text}), flush=True)
+        elif self.role == "USER":
+            print(f"User: {text}", flush=True)
+            emit({"type": "text", "text": text})
+            
+            # CRITICAL FIX: Accumulate user input for empathy evaluation
+            if not hasattr(self, '_current_user_input'):
+                self._current_user_input = ""
+            
+            # CRITICAL: Ensure we're accumulating the actual text
+            if text and text.strip():
+                self._current_user_input += text
+                if NOVA_DEBUG:
+                    print(f"🔍 DEBUG: Accumulated user input now: {len(self._current_user_input)} chars", flush=True)
+            
+            # CRITICAL FIX: Save USER message to database immediately
+            if text.strip():
+                print(f"💾 SAVING USER MESSAGE TO DB: {text[:50]}...", flush=True)
+                asyncio.create_task(self._save_user_message_async(text))
                 
-                # CRITICAL FIX: Accumulate user input for empathy evaluation
-                if not hasattr(self, '_current_user_input'):
-                    self._current_user_input = ""
+                logger.info(f"🧠 USER MESSAGE - Checking empathy: {text[:30]}...")
                 
-                # CRITICAL: Ensure we're accumulating the actual text
-                if text and text.strip():
-                    self._current_user_input += text
-                    print(f"🔍 DEBUG: Accumulated user input now: {len(self._current_user_input)} chars", flush=True)
+                # Use the direct empathy evaluation method for voice inputs
+                patient_context = f"Patient: {self.patient_name}, Condition: {self.patient_prompt}"
+                asyncio.create_task(self._evaluate_empathy(text, patient_context))
                 
-                # CRITICAL FIX: Save USER message to database immediately
-                if text.strip():
-                    print(f"💾 SAVING USER MESSAGE TO DB: {text[:50]}...", flush=True)
-                    asyncio.create_task(self._save_user_message_async(text))
-                    
-                    logger.info(f"🧠 USER MESSAGE - Checking empathy: {text[:30]}...")
-                    
-                    # Use the direct empathy evaluation method for voice inputs
-                    patient_context = f"Patient: {self.patient_name}, Condition: {self.patient_prompt}"
-                    asyncio.create_task(self._evaluate_empathy(text, patient_context))
-                    
-                    # Check for diagnosis if LLM completion is enabled
-                    if self.llm_completion:
-                        asyncio.create_task(self._evaluate_diagnosis_async(text))
+                # Check for diagnosis if LLM completion is enabled
+                if self.llm_completion:
+                    asyncio.create_task(self._evaluate_diagnosis_async(text))
 
-            logger.info(f"💬 [add_message] {self.role.upper()} | {self.session_id} | {text[:30]}")
+        logger.info(f"💬 [add_message] {self.role.upper()} | {self.session_id} | {text[:30]}")
 
-            # Mirror to PostgreSQL
-            try:
-                normalized_role = "ai" if self.role and self.role.upper() == "ASSISTANT" else "user"
-                langchain_chat_history.add_message(self.session_id, normalized_role, text)
+        # Mirror to PostgreSQL without blocking the response stream
+        asyncio.create_task(self._mirror_message_async(self.role, text))
+
+    def _on_audio_output(self, audio_output):
+        b64 = audio_output["content"]
+        # Forwarded untouched; the PCM length follows from the base64 length and padding
+        emit_audio(b64.encode("ascii"), len(b64) // 4 * 3 - b64[-2:].count("="))
+
+    async def _mirror_message_async(self, role, text):
+        """Run the blocking PostgreSQL mirror on the ordered writer thread"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(PG_MIRROR_EXECUTOR, self._mirror_message, role, text)
+
+    def _mirror_message(self, role, text):
+        """Mirror one transcript message to chat history and the messages table"""
+        try:
+            normalized_role = "ai" if role and role.upper() == "ASSISTANT" else "user"
+            langchain_chat_history.add_message(self.session_id, normalized_role, text)
+            
+            # Save ALL messages to messages table (both USER and ASSISTANT)
+            if role and role.upper() == "ASSISTANT":
+                print(f"💾 SAVING ASSISTANT MESSAGE TO DB: {text[:50]}...", flush=True)
+                self._save_message_to_db(self.session_id, False, text, None)
+            elif role and role.upper() == "USER":
+                print(f"💾 SAVING USER MESSAGE TO DB (BACKUP): {text[:50]}...", flush=True)
+                # Backup save in case async save fails
+                self._save_message_to_db(self.session_id, True, text, None)
                 
-                # Save ALL messages to messages table (both USER and ASSISTANT)
-                if self.role and self.role.upper() == "ASSISTANT":
-                    print(f"💾 SAVING ASSISTANT MESSAGE TO DB: {text[:50]}...", flush=True)
-                    self._save_message_to_db(self.session_id, False, text, None)
-                elif self.role and self.role.upper() == "USER":
-                    print(f"💾 SAVING USER MESSAGE TO DB (BACKUP): {text[:50]}...", flush=True)
-                    # Backup save in case async save fails
-                    self._save_message_to_db(self.session_id, True, text, None)
-                    
-                logger.info(f"💬 [PG INSERT] {normalized_role.upper()} | {self.session_id} | {text[:30]}")
-            except Exception as e:
-                print(f"❌ Failed to insert message into PostgreSQL: {e}", flush=True)
-
-        # audioOutput
-        elif "audioOutput" in evt:
-            b64 = evt["audioOutput"]["content"]
-            audio_bytes = base64.b64decode(b64)
-            await self.audio_queue.put(audio_bytes)
-            print(json.dumps({
-                "type": "audio",
-                "data": b64,
-                "size": len(audio_bytes)
-            }), flush=True)
+            logger.info(f"💬 [PG INSERT] {normalized_role.upper()} | {self.session_id} | {text[:30]}")
+        except Exception as e:
+            print(f"❌ Failed to insert message into PostgreSQL: {e}", flush=True)
 
     def _get_bedrock_client(self):
         """Cached bedrock client"""
         if not self._bedrock_client:
-            self._bedrock_client = boto3.client("bedrock-runtime", region_name="us-east-1")
+            self._bedrock_client = get_bedrock_invoke_client("us-east-1")
         return self._bedrock_client
     
     def _get_empathy_prompt(self):
@@ -742,10 +918,12 @@ Provide structured evaluation with detailed justifications for each score.
             
         try:
             print(f"🧠 VOICE: Creating bedrock client for region: {self.deployment_region or 'us-east-1'}", flush=True)
-            bedrock_client = boto3.client("bedrock-runtime", region_name=self.deployment_region or 'us-east-1')
+            bedrock_client = get_bedrock_invoke_client(self.deployment_region or 'us-east-1')
+            
+            # The prompt lookup and model call block, so they run off the event loop that carries the audio
             
             # Get admin-controlled empathy prompt (same as chat.py)
-            empathy_prompt_template = self._get_empathy_prompt()
+            empathy_prompt_template = await asyncio.to_thread(self._get_empathy_prompt)
             logger.info(f"🎯 VOICE: EMPATHY PROMPT LENGTH: {len(empathy_prompt_template)} characters")
             
             try:
@@ -794,7 +972,8 @@ Provide structured evaluation with detailed justifications for each score.
             }
             
             try:
-                response = bedrock_client.invoke_model(
+                response = await asyncio.to_thread(
+                    bedrock_client.invoke_model,
                     modelId="amazon.nova-pro-v1:0",
                     contentType="application/json",
                     accept="application/json",
@@ -803,8 +982,9 @@ Provide structured evaluation with detailed justifications for each score.
                 logger.info("✅ VOICE: BEDROCK MODEL CALL SUCCESSFUL")
             except Exception as model_error:
                 logger.warning(f"VOICE: Nova Pro failed in deployment region, trying us-east-1: {model_error}")
-                fallback_client = boto3.client("bedrock-runtime", region_name="us-east-1")
-                response = fallback_client.invoke_model(
+                fallback_client = get_bedrock_invoke_client("us-east-1")
+                response = await asyncio.to_thread(
+                    fallback_client.invoke_model,
                     modelId="amazon.nova-pro-v1:0",
                     contentType="application/json",
                     accept="application/json",
@@ -812,7 +992,7 @@ Provide structured evaluation with detailed justifications for each score.
                 )
                 logger.info("✅ VOICE: BEDROCK FALLBACK CALL SUCCESSFUL")
             
-            result = json.loads(response["body"].read())
+            result = json.loads(await asyncio.to_thread(response["body"].read))
             response_text = result["output"]["message"]["content"][0]["text"]
             logger.info(f"📝 VOICE: BEDROCK RESPONSE LENGTH: {len(response_text)} characters")
             
@@ -850,13 +1030,13 @@ Provide structured evaluation with detailed justifications for each score.
                 empathy_result["judge_model"] = "amazon.nova-pro-v1:0"
                 
                 # Save to database
-                self._save_message_to_db(self.session_id, True, student_response, empathy_result)
+                await asyncio.to_thread(self._save_message_to_db, self.session_id, True, student_response, empathy_result)
                 
                 # Send empathy feedback
                 empathy_feedback = self._build_empathy_feedback(empathy_result)
                 if empathy_feedback:
-                    print(json.dumps({"type": "empathy", "content": empathy_feedback}), flush=True)
-                    print(json.dumps({"type": "empathy_data", "content": json.dumps(empathy_result)}), flush=True)
+                    emit({"type": "empathy", "content": empathy_feedback})
+                    emit({"type": "empathy_data", "content": orjson.dumps(empathy_result).decode()})
                     logger.info(f"🧠 VOICE: Empathy feedback sent to frontend")
                 
                 logger.info(f"✅ VOICE: EMPATHY EVALUATION COMPLETED SUCCESSFULLY")
@@ -872,7 +1052,7 @@ Provide structured evaluation with detailed justifications for each score.
             logger.error(f"❌ VOICE: EMPATHY EVALUATION ERROR: {e}")
             # Fallback: Save message without empathy data
             try:
-                self._save_message_to_db(self.session_id, True, student_response, None)
+                await asyncio.to_thread(self._save_message_to_db, self.session_id, True, student_response, None)
                 logger.info(f"🧠 VOICE: Message saved without empathy data as fallback")
             except Exception as save_error:
                 logger.error(f"🧠 VOICE: Failed to save message as fallback: {save_error}")
@@ -902,9 +1082,7 @@ Provide structured evaluation with detailed justifications for each score.
             return_pg_connection(conn)
             
             # Get database credentials
-            secrets_client = boto3.client('secretsmanager')
-            secret_response = secrets_client.get_secret_value(SecretId=db_secret_name)
-            secret = json.loads(secret_response['SecretString'])
+            secret = get_db_secret()
             
             # Create embeddings and vectorstore connection
             bedrock_client = self._get_bedrock_client()
@@ -958,22 +1136,23 @@ Provide structured evaluation with detailed justifications for each score.
                 logger.warning("🩺 VOICE: Database credentials not available for diagnosis")
                 return
             
+            # Secrets, PGVector, the search and the model call all block, so they run off the event loop
             # Get database credentials
-            secrets_client = boto3.client('secretsmanager')
-            secret_response = secrets_client.get_secret_value(SecretId=db_secret_name)
-            secret = json.loads(secret_response['SecretString'])
+            secret = await asyncio.to_thread(get_db_secret)
             
-            # Create bedrock client and embeddings
-            bedrock_client = boto3.client("bedrock-runtime", region_name=self.deployment_region or 'us-east-1')
+            # Shared bedrock client and embeddings
+            bedrock_client = get_bedrock_invoke_client(self.deployment_region or 'us-east-1')
             embeddings = BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=bedrock_client)
             
             # Connect to vectorstore using RDS proxy
             connection_string = f"postgresql://{secret['username']}:{secret['password']}@{rds_endpoint}:{secret['port']}/{secret['dbname']}"
-            vectorstore = PGVector(embedding_function=embeddings, collection_name=self.patient_id, connection_string=connection_string)
+            vectorstore = await asyncio.to_thread(
+                PGVector, embedding_function=embeddings, collection_name=self.patient_id, connection_string=connection_string
+            )
             
             # Search for relevant medical documents
             try:
-                docs = vectorstore.similarity_search(text, k=3)
+                docs = await asyncio.to_thread(vectorstore.similarity_search, text, k=3)
                 
                 if docs and len(docs) > 0:
                     # Filter out empty documents
@@ -1000,7 +1179,8 @@ Provide structured evaluation with detailed justifications for each score.
             }
             
             try:
-                response = bedrock_client.invoke_model(
+                response = await asyncio.to_thread(
+                    bedrock_client.invoke_model,
                     modelId="amazon.nova-lite-v1:0",
                     contentType="application/json",
                     accept="application/json",
@@ -1009,8 +1189,9 @@ Provide structured evaluation with detailed justifications for each score.
                 logger.info("✅ VOICE: DIAGNOSIS MODEL CALL SUCCESSFUL")
             except Exception as model_error:
                 logger.warning(f"🩺 VOICE: Nova Lite failed in deployment region, trying us-east-1: {model_error}")
-                fallback_client = boto3.client("bedrock-runtime", region_name="us-east-1")
-                response = fallback_client.invoke_model(
+                fallback_client = get_bedrock_invoke_client("us-east-1")
+                response = await asyncio.to_thread(
+                    fallback_client.invoke_model,
                     modelId="amazon.nova-lite-v1:0",
                     contentType="application/json",
                     accept="application/json",
@@ -1018,14 +1199,14 @@ Provide structured evaluation with detailed justifications for each score.
                 )
                 logger.info("✅ VOICE: DIAGNOSIS FALLBACK CALL SUCCESSFUL")
             
-            result = json.loads(response["body"].read())
+            result = json.loads(await asyncio.to_thread(response["body"].read))
             verdict_text = result["output"]["message"]["content"][0]["text"].strip()
             
             logger.info(f"🩺 VOICE: Diagnosis verdict: {verdict_text}")
             print(f"🩺 Diagnosis verdict: {verdict_text}", flush=True)
             
             if verdict_text.lower() == "true":
-                print(json.dumps({"type": "diagnosis_verdict", "verdict": True}), flush=True)
+                emit({"type": "diagnosis_verdict", "verdict": True})
                 logger.info("🩺 VOICE: Correct diagnosis detected - session completion triggered")
                 
         except Exception as e:
@@ -1094,27 +1275,29 @@ Provide structured evaluation with detailed justifications for each score.
             logger.info("🔗 VOICE_DB_SAVE: Using centralized voice connection manager")
             
             conn = get_pg_connection()
-            cursor = conn.cursor()
-            
-            # Insert into messages table
-            insert_query = """
-                INSERT INTO messages (session_id, student_sent, message_content, empathy_evaluation, time_sent) 
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            
-            empathy_json = json.dumps(empathy_data) if empathy_data else None
-            
-            cursor.execute(insert_query, (
-                session_id,
-                is_student,
-                content,
-                empathy_json,
-                datetime.now()
-            ))
-            
-            conn.commit()
-            cursor.close()
-            return_pg_connection(conn)
+            try:
+                cursor = conn.cursor()
+                
+                # Insert into messages table
+                insert_query = """
+                    INSERT INTO messages (session_id, student_sent, message_content, empathy_evaluation, time_sent) 
+                    VALUES (%s, %s, %s, %s, %s)
+                """
+                
+                empathy_json = orjson.dumps(empathy_data).decode() if empathy_data else None
+                
+                cursor.execute(insert_query, (
+                    session_id,
+                    is_student,
+                    content,
+                    empathy_json,
+                    datetime.now()
+                ))
+                
+                conn.commit()
+                cursor.close()
+            finally:
+                return_pg_connection(conn)
             
             print(f"✅ DB SAVE COMPLETE: Message saved to database using voice connection manager", flush=True)
             logger.info(f"💾 Message saved to DB using voice connection manager")
@@ -1133,6 +1316,79 @@ Provide structured evaluation with detailed justifications for each score.
             raise e
 
 
+class StdinLineProtocol(asyncio.BufferedProtocol):
+    """Read NDJSON commands from a pipe into one reused buffer"""
+
+    def __init__(self):
+        self._buffer = bytearray(STDIN_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._partial = bytearray()  # tail of a line still waiting for its newline
+        self._lines = collections.deque()
+        self._waiter = None
+        self._eof = False
+        self._paused = False
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self._view
+
+    def buffer_updated(self, nbytes):
+        self._split_lines(self._buffer, self._view, nbytes)
+
+    def data_received(self, data):
+        # The stdlib pipe transport only speaks the plain Protocol interface
+        self._split_lines(data, memoryview(data), len(data))
+
+    def _split_lines(self, data, view, nbytes):
+        start = 0
+        while (end := data.find(b"\n", start, nbytes)) >= 0:
+            if self._partial:
+                self._partial += view[start:end]
+                self._lines.append(bytes(self._partial))
+                self._partial.clear()
+            else:
+                self._lines.append(bytes(view[start:end]))
+            start = end + 1
+        self._partial += view[start:nbytes]
+
+        # Stop reading while the command handler is behind; the pipe buffers upstream
+        if len(self._lines) >= STDIN_MAX_PENDING_LINES and not self._paused:
+            self._paused = True
+            self.transport.pause_reading()
+        self._wake()
+
+    def eof_received(self):
+        if self._partial:
+            self._lines.append(bytes(self._partial))
+            self._partial.clear()
+        self._eof = True
+        self._wake()
+
+    def connection_lost(self, exc):
+        self._eof = True
+        self._wake()
+
+    def _wake(self):
+        if self._waiter and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def readline(self):
+        """Return the next line without its newline, or None at EOF"""
+        while not self._lines:
+            if self._eof:
+                return None
+            self._waiter = asyncio.get_running_loop().create_future()
+            await self._waiter
+            self._waiter = None
+        if self._paused and len(self._lines) < STDIN_MAX_PENDING_LINES // 2:
+            self._paused = False
+            self.transport.resume_reading()
+        return self._lines.popleft()
+
+
 # Main execution loop
 if __name__ == "__main__":
     import sys
@@ -1144,10 +1400,13 @@ if __name__ == "__main__":
         """Handle commands from server.js via stdin"""
         global nova
         
+        loop = asyncio.get_running_loop()
+        _, reader = await loop.connect_read_pipe(StdinLineProtocol, sys.stdin)
+        
         while True:
             try:
-                line = await asyncio.get_event_loop().run_in_executor(None, sys.stdin.readline)
-                if not line:
+                line = await reader.readline()
+                if line is None:
                     break
                     
                 line = line.strip()
@@ -1155,12 +1414,12 @@ if __name__ == "__main__":
                     continue
                     
                 try:
-                    command = json.loads(line)
+                    command = orjson.loads(line)
                     print(f"💬 STDIN COMMAND: {command.get('type', 'unknown')}", flush=True)
                     
                     if command["type"] == "start_session":
                         if nova:
-                            await nova.end_session()
+                            await nova.end_session(drain=False)
                         nova = NovaSonic(
                             session_id=command.get("session_id", "default"),
                             voice_id=command.get("voice_id"),
@@ -1171,8 +1430,8 @@ if __name__ == "__main__":
                         await nova.start_audio_input()
                         
                     elif command["type"] == "audio" and nova:
-                        audio_data = base64.b64decode(command["data"])
-                        await nova.send_audio_chunk(audio_data)
+                        # server.js already sends base64 PCM, which is what Bedrock expects
+                        await nova.send_audio_chunk_b64(command["data"])
                         
                     elif command["type"] == "end_audio" and nova:
                         await nova.end_audio_input()
@@ -1194,7 +1453,7 @@ if __name__ == "__main__":
                         nova = None
                         
                 except json.JSONDecodeError as je:
-                    print(f"❌ JSON DECODE ERROR: {je} - Line: {line}", flush=True)
+                    print(f"❌ JSON DECODE ERROR: {je} - Line: {line.decode(errors='replace')}", flush=True)
                 except Exception as cmd_error:
                     print(f"❌ COMMAND ERROR: {cmd_error}", flush=True)
                     logger.error(f"Command processing error: {cmd_error}")
@@ -1208,10 +1467,17 @@ if __name__ == "__main__":
         """Main async function"""
         global nova
         
+        # Run short-lived tasks eagerly until their first real suspension (3.12+)
+        if hasattr(asyncio, "eager_task_factory"):
+            asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+        
         try:
             print(f"🚀 Nova Sonic Python process started", flush=True)
             logger.info("Nova Sonic process initialized")
             
+            # Warm DB credentials and the connection pool while the session starts
+            asyncio.get_running_loop().run_in_executor(None, voice_db_manager.prefetch)
+            
             # Auto-start session if environment variables are present
             session_id = os.getenv("SESSION_ID", "default")
             voice_id = os.getenv("VOICE_ID")
@@ -1239,5 +1505,6 @@ if __name__ == "__main__":
             print(f"🚫 Nova Sonic process ended", flush=True)
             logger.info("Nova Sonic process ended")
     
-    # Run the main async function
-    asyncio.run(main())
\ No newline at end of file
+    # Run the main async function on a libuv-backed loop
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        runner.run(main())
\ No newline at end of file
@@ -122,23 +122,30 @@ io.on("connection", (socket) => {
     }
 
     // Capture stdout and stderr
-    novaProcess.stdout.on("data", (data) => {
-      data
-        .toString()
-        .split("\n")
+    // Pipe chunks don't follow line boundaries (Python batches several NDJSON lines
+    // per write), so carry a trailing partial line over to the next chunk
+    let stdoutTail = "";
+    novaProcess.stdout.setEncoding("utf8");
+    const onNovaStdout = (data) => {
+      const lines = (stdoutTail + data).split("\n");
+      stdoutTail = lines.pop();
+      lines
         .filter(Boolean)
         .forEach((line) => {
           try {
             const parsed = JSON.parse(line);
-            console.log("📤 NOVA JSON:", parsed);
 
             // ─ Audio chunks ───────────────────────────────────────────────
             if (parsed.type === "audio") {
-              // Skip debug file saving for better performance
+              // Skip debug file saving and logging the base64 payload for better performance
               socket.emit("audio-chunk", { data: parsed.data });
+              return;
             }
+
+            console.log("📤 NOVA JSON:", parsed);
+
             // ─ Debug messages ───────────────────────────────────────────
-            else if (parsed.type === "debug") {
+            if (parsed.type === "debug") {
               console.log("🐞 NOVA DEBUG:", parsed.text);
             }
             // ─ Voice empathy evaluation results ──────────────────────────
@@ -241,6 +248,12 @@ io.on("connection", (socket) => {
             }
           }
         });
+    };
+    novaProcess.stdout.on("data", onNovaStdout);
+    // Text, empathy and diagnosis messages share this stream; don't lose a final
+    // line that arrives without its newline when the process exits
+    novaProcess.stdout.on("end", () => {
+      if (stdoutTail) onNovaStdout("\n");
     });
 
     novaProcess.stderr.on("data", (data) => {
@@ -17,6 +17,9 @@ import time
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# One Secrets Manager client for the process lifetime
+secrets_client = boto3.client('secretsmanager')
+
 class VoiceConnectionManager:
     """
     Singleton database connection manager optimized for voice processing workloads
@@ -39,6 +42,8 @@ class VoiceConnectionManager:
             
         self._initialized = True
         self._pool = None
+        self._pool_lock = threading.Lock()
+        self._secret = None
         self._config = None
         self._last_health_check = 0
         self._health_check_interval = 300  # 5 minutes
@@ -52,6 +57,16 @@ class VoiceConnectionManager:
         logger.info("🔗 VOICE_DB_MANAGER: Initializing voice connection manager")
         logger.info(f"🔗 VOICE_POOL_CONFIG: min={self.min_connections}, max={self.max_connections}, timeout={self.connection_timeout}s")
         
+    def get_db_secret(self) -> Dict[str, Any]:
+        """Get the DB credentials secret, fetched once per process"""
+        if self._secret is None:
+            db_secret_name = os.environ.get('SM_DB_CREDENTIALS')
+            if not db_secret_name:
+                raise ValueError("Missing required environment variable: SM_DB_CREDENTIALS")
+            secret_response = secrets_client.get_secret_value(SecretId=db_secret_name)
+            self._secret = json.loads(secret_response['SecretString'])
+        return self._secret
+    
     def _get_db_config(self) -> Dict[str, Any]:
         """Get database configuration from environment and secrets"""
         if self._config is not None:
@@ -66,9 +81,7 @@ class VoiceConnectionManager:
                 raise ValueError("Missing required environment variables: SM_DB_CREDENTIALS, RDS_PROXY_ENDPOINT")
             
             # Get credentials from AWS Secrets Manager
-            secrets_client = boto3.client('secretsmanager')
-            secret_response = secrets_client.get_secret_value(SecretId=db_secret_name)
-            secret = json.loads(secret_response['SecretString'])
+            secret = self.get_db_secret()
             
             self._config = {
                 'host': rds_endpoint,
@@ -114,7 +127,9 @@ class VoiceConnectionManager:
     def get_connection(self):
         """Get connection from pool (non-context manager for compatibility)"""
         if self._pool is None:
-            self._create_pool()
+            with self._pool_lock:
+                if self._pool is None:
+                    self._create_pool()
         
         try:
             logger.debug("🔗 VOICE_CONNECTION_REQUEST: Getting connection from voice pool")
@@ -130,6 +145,14 @@ class VoiceConnectionManager:
             logger.error(f"❌ VOICE_CONNECTION_ERROR: {e}")
             raise
     
+    def prefetch(self):
+        """Fetch credentials and open the pool ahead of the first query"""
+        try:
+            self.return_connection(self.get_connection())
+            logger.info("✅ VOICE_POOL_PREFETCHED: Credentials and pool ready")
+        except Exception as e:
+            logger.warning(f"⚠️ VOICE_POOL_PREFETCH_FAILED: {e}")
+    
     def return_connection(self, connection):
         """Return connection to pool"""
         if connection and self._pool:
@@ -178,6 +201,10 @@ def return_pg_connection(connection):
     """Return PostgreSQL connection (backward compatibility)"""
     voice_db_manager.return_connection(connection)
 
+def get_db_secret():
+    """Get the cached DB credentials secret"""
+    return voice_db_manager.get_db_secret()
+
 # Log initialization
 logger.info("🏗️ VOICE_RDS_OPTIMIZATION: Voice connection manager loaded")
 logger.info("🏗️ VOICE_CONNECTION_POOLING: Optimized for Nova Sonic voice processing")
\ No newline at end of file